@@ -1,34 +1,50 @@
 import logging
 import asyncio
-import json
+import base64
+import functools
+import hashlib
+import html
+import math
 import os
+import random
+import sys
 import time
-from datetime import datetime, timezone
-import pytz
+import weakref
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from urllib.parse import urlsplit
 import httpx
-import random
+import orjson
 
 from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
 )
 from telegram.constants import ParseMode, ChatAction
-from telegram.error import BadRequest
+from telegram.error import BadRequest, TelegramError
+from telegram.request import HTTPXRequest
 
 # --- Konfigurasi Global ---
 # Menggunakan environment variable untuk token bot
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
-if not TELEGRAM_BOT_TOKEN:
-    raise ValueError("TELEGRAM_BOT_TOKEN environment variable tidak ditemukan!")
 
 ENABLE_DETAILED_CONSOLE_LOGS = os.environ.get('ENABLE_DETAILED_LOGS', 'true').lower() == 'true'
-WIB = pytz.timezone('Asia/Jakarta')
+# Asia/Jakarta tetap UTC+7 tanpa DST, jadi offset tetap cukup (tanpa tabel transisi pytz)
+WIB = timezone(timedelta(hours=7), name="WIB")
+WIB_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S %Z'
 
 # Menggunakan port dari environment variable untuk Render
 PORT = int(os.environ.get('PORT', 8000))
+RENDER_HOST = os.environ.get('RENDER_EXTERNAL_HOSTNAME', '')
+# WEBHOOK_URL eksplisit (mis. domain kustom) didahulukan; jika kosong diturunkan dari hostname Render
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL') or (f"https://{RENDER_HOST}/{TELEGRAM_BOT_TOKEN}" if RENDER_HOST else None)
+WEBHOOK_PATH = urlsplit(WEBHOOK_URL).path.lstrip('/') if WEBHOOK_URL else ''
+# Telegram mengirim nilai ini di header X-Telegram-Bot-Api-Secret-Token; request tanpa header yang cocok ditolak
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or (hashlib.sha256(TELEGRAM_BOT_TOKEN.encode()).hexdigest() if TELEGRAM_BOT_TOKEN else None)
 
 BASE_API_HEADERS = {
     'User-Agent': "okhttp/4.12.0",
@@ -42,13 +58,51 @@ AUTH_URL = f"{API_BASE_URL}/auth/current-user"
 TOKEN_INFO_URL = f"{API_BASE_URL}/token/get-token"
 CHECK_CLAIMABLE_URL = f"{API_BASE_URL}/token/check-is-claimable"
 CLAIM_AIRDROP_URL = f"{API_BASE_URL}/token/claim-airdrop"
+# Penanda body 2xx kosong dari make_api_request, dan teks khusus untuk kode error klaim yang sering muncul
+EMPTY_RESPONSE_MESSAGE = "Respons kosong dari server."
+CLAIM_ERROR_MESSAGES = {(400, "TOKEN_CLAIM_TOO_EARLY"): "Gagal Klaim: Waktu klaim token terlalu dini."}
 
 USER_DATA_DIR = "user_data"
 CLAIM_HISTORY_DIR = "claim_history"
+HTTP_CLIENT: httpx.AsyncClient | None = None
+# Token dianggap kedaluwarsa sedikit lebih awal dari klaim 'exp' untuk menutup selisih jam dan latensi request
+TOKEN_EXPIRY_MARGIN = 60
+# Cooldown bersama setelah API membalas 429, berlaku untuk semua pengguna (backoff eksponensial + jitter):
+# semua request berasal dari satu IP server, jadi 429 untuk satu pengguna berarti batas itu berlaku untuk semuanya.
+# Request interaktif (perintah pengguna) melewati pemeriksaan ini lewat bypass_cooldown, tetapi tetap memperbarui cooldown
+API_COOLDOWN_UNTIL = 0.0
+CONSECUTIVE_429 = 0
 AUTO_CLAIM_TASKS = {}
-USER_LOCKS = {}
+# Lock hanya hidup selama ada yang memegangnya, sehingga lock pengguna yang tidak aktif dibuang oleh GC
+USER_LOCKS: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+# Lock terpisah per pengguna untuk menyerialkan update (perintah/tombol); tidak bisa memakai USER_LOCKS karena
+# handler memanggil save_user_data yang mengambil lock tersebut, sedangkan asyncio.Lock tidak reentrant
+USER_UPDATE_LOCKS: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+# Cache write-through untuk data pengguna (LRU) agar get_auth_token tidak membaca disk setiap kali
+USER_DATA_CACHE_MAXSIZE = 10_000
+USER_DATA_CACHE: "OrderedDict[int, dict]" = OrderedDict()
+# Hash konten terakhir per (chat_id, message_id) agar edit yang tidak mengubah apa pun tidak dikirim ke Telegram
+LAST_RENDER_MAXSIZE = 10_000
+LAST_RENDER: "OrderedDict[tuple[int, int], int]" = OrderedDict()
+# Hash isi terakhir yang berhasil ditulis per file (LRU, ukuran sama dengan USER_DATA_CACHE), agar penyimpanan tanpa perubahan tidak menulis ulang
+LAST_WRITTEN_HASH: "OrderedDict[str, int]" = OrderedDict()
 LAST_LONG_WAIT_NOTIFICATION = {}
 
+BOT_COMMANDS: tuple[BotCommand, ...] = (
+    BotCommand("start", "Tampilkan menu utama"),
+    BotCommand("help", "Tampilkan bantuan dan menu utama"),
+    BotCommand("settoken", "Atur token autentikasi Interlink"),
+    BotCommand("profile", "Lihat profil pengguna"),
+    BotCommand("tokens", "Lihat informasi token"),
+    BotCommand("claimstatus", "Periksa status klaim"),
+    BotCommand("claim", "Lakukan klaim token"),
+    BotCommand("history", "Lihat riwayat klaim"),
+    BotCommand("autoclaim_start", "Aktifkan auto-claim"),
+    BotCommand("autoclaim_stop", "Nonaktifkan auto-claim"),
+    BotCommand("autoclaim_status", "Lihat status auto-claim"),
+)
+BOT_COMMANDS_HASH_FILE = os.path.join(USER_DATA_DIR, ".bot_commands_hash.json")
+
 log_level = logging.INFO if ENABLE_DETAILED_CONSOLE_LOGS else logging.WARNING
 logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(name)s (%(module)s.%(funcName)s:%(lineno)d) - %(message)s",
@@ -58,178 +112,348 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+if not TELEGRAM_BOT_TOKEN:
+    # Exit code non-zero agar Render menandai deploy gagal dan menampilkan kesalahan konfigurasi
+    logger.critical("TELEGRAM_BOT_TOKEN environment variable tidak ditemukan! Bot tidak dapat dijalankan.")
+    sys.exit(2)
+
+# Membatasi jumlah request paralel ke API Interlink agar tidak memicu 429/timeout beruntun
+CLAIM_CONCURRENCY_RAW = os.environ.get("CLAIM_CONCURRENCY", "50")
+try:
+    CLAIM_CONCURRENCY = int(CLAIM_CONCURRENCY_RAW)
+except ValueError:
+    CLAIM_CONCURRENCY = 0
+if CLAIM_CONCURRENCY < 1:
+    # 0 membuat setiap request menunggu selamanya, nilai negatif/non-angka membuat startup gagal tanpa pesan yang jelas
+    logger.critical("CLAIM_CONCURRENCY harus bilangan bulat >= 1, diterima: %r. Bot tidak dapat dijalankan.", CLAIM_CONCURRENCY_RAW)
+    sys.exit(2)
+CLAIM_SEMAPHORE = asyncio.Semaphore(CLAIM_CONCURRENCY)
+
 os.makedirs(USER_DATA_DIR, exist_ok=True)
 os.makedirs(CLAIM_HISTORY_DIR, exist_ok=True)
 
+# --- Request Bot API ---
+class OrjsonHTTPXRequest(HTTPXRequest):
+    # Respons Bot API di-decode dengan orjson, bukan json stdlib
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError as exc:
+            logger.error("Gagal memuat data JSON dari Bot API: %s", payload[:200])
+            raise TelegramError("Invalid server response") from exc
+
 # --- Helper Functions (Sama seperti sebelumnya) ---
+# Path per pengguna tidak pernah berubah, jadi cukup dibangun sekali per user_id
+@functools.lru_cache(maxsize=4096)
 def get_user_data_file(user_id: int) -> str: return os.path.join(USER_DATA_DIR, f"{user_id}.json")
-def get_user_claim_history_file(user_id: int) -> str: return os.path.join(CLAIM_HISTORY_DIR, f"{user_id}_history.json")
-async def get_user_lock(user_id: int) -> asyncio.Lock:
-    if user_id not in USER_LOCKS: USER_LOCKS[user_id] = asyncio.Lock()
-    return USER_LOCKS[user_id]
+@functools.lru_cache(maxsize=4096)
+def get_user_claim_history_file(user_id: int) -> str: return os.path.join(CLAIM_HISTORY_DIR, f"{user_id}_history.jsonl")
+@functools.lru_cache(maxsize=4096)
+def get_legacy_claim_history_file(user_id: int) -> str: return os.path.join(CLAIM_HISTORY_DIR, f"{user_id}_history.json")
+def get_user_update_lock(user_id: int) -> asyncio.Lock:
+    lock = USER_UPDATE_LOCKS.get(user_id)
+    if lock is None:
+        lock = USER_UPDATE_LOCKS[user_id] = asyncio.Lock()
+    return lock
+def get_user_lock(user_id: int) -> asyncio.Lock:
+    # Ambil-atau-buat dalam satu langkah tanpa await, jadi tidak ada dua lock untuk pengguna yang sama
+    lock = USER_LOCKS.get(user_id)
+    if lock is None:
+        lock = USER_LOCKS[user_id] = asyncio.Lock()
+    return lock
+def _read_json_file(path: str):
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+def _write_file_atomic(path: str, payload: bytes):
+    # Tulis ke file sementara lalu os.replace, sehingga pembaca tidak pernah melihat file setengah jadi
+    # os.open/os.write langsung (tanpa buffer file object); 0o600 karena file berisi token autentikasi.
+    # Tanpa fsync: disk Render bersifat sementara, sementara fsync mendominasi latensi penulisan
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        view = memoryview(payload)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+def _read_json_lines(path: str, limit: int | None = None) -> list:
+    with open(path, 'rb') as f:
+        lines = f.readlines()
+    entries = []
+    # Dengan limit, decode dimulai dari akhir dan berhenti setelah `limit` entri valid; baris kosong/rusak tidak dihitung
+    for line in (lines if limit is None else reversed(lines)):
+        if limit is not None and len(entries) >= limit:
+            break
+        if not line.strip():
+            continue
+        try:
+            entries.append(orjson.loads(line))
+        except orjson.JSONDecodeError:
+            # Baris terakhir bisa terpotong bila proses mati saat menambahkan entri
+            logger.warning("Melewati baris riwayat klaim yang rusak di %s.", path)
+    if limit is not None:
+        entries.reverse()
+    return entries
+def _append_line(path: str, line: bytes):
+    with open(path, 'ab+') as f:
+        # Baris terakhir yang terpotong ditutup dulu dengan newline agar entri baru tidak ikut menempel dan rusak
+        if f.seek(0, os.SEEK_END) > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+def _remember_written_hash(path: str, payload_hash: int):
+    LAST_WRITTEN_HASH[path] = payload_hash
+    LAST_WRITTEN_HASH.move_to_end(path)
+    if len(LAST_WRITTEN_HASH) > USER_DATA_CACHE_MAXSIZE:
+        LAST_WRITTEN_HASH.popitem(last=False)
+
+def _cache_user_data(user_id: int, data: dict):
+    USER_DATA_CACHE[user_id] = data
+    USER_DATA_CACHE.move_to_end(user_id)
+    if len(USER_DATA_CACHE) > USER_DATA_CACHE_MAXSIZE:
+        USER_DATA_CACHE.popitem(last=False)
+
 async def load_user_data(user_id: int) -> dict:
-    # ... (kode sama)
+    cached = USER_DATA_CACHE.get(user_id)
+    if cached is not None:
+        USER_DATA_CACHE.move_to_end(user_id)
+        return cached
+    # Pembacaan tanpa lock (penulisan bersifat atomik) dan dijalankan di thread agar event loop tidak terblokir
     data_file = get_user_data_file(user_id)
-    async with await get_user_lock(user_id):
-        if os.path.exists(data_file):
-            try:
-                with open(data_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                logger.error(f"Gagal memuat data JSON untuk pengguna {user_id}. File rusak atau format tidak valid.")
-                return {}
-        return {}
+    data = {}
+    if os.path.exists(data_file):
+        try:
+            data = await asyncio.to_thread(_read_json_file, data_file)
+        except orjson.JSONDecodeError:
+            logger.error("Gagal memuat data JSON untuk pengguna %s. File rusak atau format tidak valid.", user_id)
+            return {}
+    # Jangan menimpa data yang lebih baru bila save_user_data berjalan selama file dibaca
+    if user_id not in USER_DATA_CACHE:
+        _cache_user_data(user_id, data)
+    return USER_DATA_CACHE.get(user_id, data)
 
 async def save_user_data(user_id: int, data: dict):
-    # ... (kode sama)
+    # Lock hanya untuk menyerialkan penulis pada pengguna yang sama
     data_file = get_user_data_file(user_id)
-    async with await get_user_lock(user_id):
-        try:
-            with open(data_file, 'w') as f:
-                json.dump(data, f, indent=4)
-        except Exception as e:
-            logger.error(f"Gagal menyimpan data untuk pengguna {user_id}: {e}")
-
-async def load_claim_history(user_id: int) -> list:
-    # ... (kode sama)
+    _cache_user_data(user_id, data)
+    try:
+        # Serialisasi di luar lock; lock hanya melingkupi penulisan file
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        payload_hash = hash(payload)
+        async with get_user_lock(user_id):
+            # Pemeriksaan hash di bawah lock dan di thread event loop; hanya penulisan file yang masuk thread pool
+            if LAST_WRITTEN_HASH.get(data_file) == payload_hash:
+                LAST_WRITTEN_HASH.move_to_end(data_file)
+                return
+            await asyncio.to_thread(_write_file_atomic, data_file, payload)
+            _remember_written_hash(data_file, payload_hash)
+    except Exception as e:
+        logger.error("Gagal menyimpan data untuk pengguna %s: %s", user_id, e)
+
+async def _migrate_legacy_claim_history(user_id: int):
+    # Konversi sekali jalan dari format lama (satu list JSON) ke JSON Lines
+    legacy_file = get_legacy_claim_history_file(user_id)
     history_file = get_user_claim_history_file(user_id)
-    async with await get_user_lock(user_id):
-        if os.path.exists(history_file):
+    async with get_user_lock(user_id):
+        if not os.path.exists(legacy_file):
+            return
+        try:
+            if os.path.exists(history_file):
+                # Tidak bisa dipastikan isinya sudah ada di .jsonl (mis. .jsonl dibuat oleh append lebih dulu),
+                # jadi file lama disisihkan sebagai *.bad alih-alih dihapus
+                await asyncio.to_thread(os.replace, legacy_file, f"{legacy_file}.bad")
+                logger.warning("Riwayat klaim lama pengguna %s ditemukan bersama file .jsonl, disisihkan ke %s.bad.", user_id, legacy_file)
+                return
             try:
-                with open(history_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                logger.error(f"Gagal memuat riwayat klaim JSON untuk pengguna {user_id}. File rusak atau format tidak valid.")
-                return []
-        return []
-
-async def save_claim_history(user_id: int, history: list):
-    # ... (kode sama)
+                legacy_history = await asyncio.to_thread(_read_json_file, legacy_file)
+            except orjson.JSONDecodeError:
+                legacy_history = None
+            if not isinstance(legacy_history, list):
+                # File rusak disisihkan sebagai *.bad agar tidak dicoba (dan dicatat) ulang pada setiap akses riwayat
+                await asyncio.to_thread(os.replace, legacy_file, f"{legacy_file}.bad")
+                logger.error("Riwayat klaim lama pengguna %s rusak atau bukan list, disisihkan ke %s.bad.", user_id, legacy_file)
+                return
+            payload = b"".join(orjson.dumps(entry) + b"\n" for entry in legacy_history)
+            await asyncio.to_thread(_write_file_atomic, history_file, payload)
+            await asyncio.to_thread(os.remove, legacy_file)
+            logger.info("Riwayat klaim pengguna %s dimigrasikan ke format JSON Lines.", user_id)
+        except OSError as e:
+            logger.error("Gagal memigrasikan riwayat klaim lama untuk pengguna %s: %s", user_id, e)
+
+async def load_claim_history(user_id: int, limit: int | None = None) -> list:
+    # limit=N mengembalikan N entri terakhir (urutan kronologis) tanpa mem-parse seluruh riwayat
     history_file = get_user_claim_history_file(user_id)
-    async with await get_user_lock(user_id):
+    if os.path.exists(get_legacy_claim_history_file(user_id)):
+        await _migrate_legacy_claim_history(user_id)
+    if os.path.exists(history_file):
         try:
-            with open(history_file, 'w') as f:
-                json.dump(history, f, indent=4)
-        except Exception as e:
-            logger.error(f"Gagal menyimpan riwayat klaim untuk pengguna {user_id}: {e}")
+            return await asyncio.to_thread(_read_json_lines, history_file, limit)
+        except OSError as e:
+            logger.error("Gagal memuat riwayat klaim untuk pengguna %s: %s", user_id, e)
+            return []
+    return []
+
+async def append_claim_history(user_id: int, entry: dict):
+    # Append-only: biaya per klaim konstan, tidak bergantung pada panjang riwayat
+    history_file = get_user_claim_history_file(user_id)
+    if os.path.exists(get_legacy_claim_history_file(user_id)):
+        await _migrate_legacy_claim_history(user_id)
+    try:
+        line = orjson.dumps(entry) + b"\n"
+        async with get_user_lock(user_id):
+            await asyncio.to_thread(_append_line, history_file, line)
+    except Exception as e:
+        logger.error("Gagal menyimpan riwayat klaim untuk pengguna %s: %s", user_id, e)
 
 # --- Fungsi API (Sama seperti sebelumnya) ---
-async def make_api_request(method: str, url: str, headers: dict, json_data=None, content_data: str | bytes | None = None, timeout=20) -> tuple[dict | None, int | None]:
+def _update_api_cooldown(status_code: int):
+    global API_COOLDOWN_UNTIL, CONSECUTIVE_429
+    if status_code == 429:
+        CONSECUTIVE_429 += 1
+        backoff = min(60 * 60, 30 * 2 ** CONSECUTIVE_429) * random.uniform(0.8, 1.2)
+        API_COOLDOWN_UNTIL = max(API_COOLDOWN_UNTIL, time.monotonic() + backoff)
+        logger.warning("API membalas 429 (%d kali berturut-turut), cooldown bersama %.0f detik.", CONSECUTIVE_429, backoff)
+    elif 200 <= status_code < 300:
+        CONSECUTIVE_429 = 0
+
+async def make_api_request(method: str, url: str, headers: dict, json_data=None, content_data: str | bytes | None = None, timeout=20, bypass_cooldown: bool = False) -> tuple[dict | None, int | None]:
     # ... (kode sama, pastikan penanganan error sudah baik)
-    async with httpx.AsyncClient() as client:
-        response_obj = None 
-        try:
+    client = HTTP_CLIENT
+    response_obj = None 
+    cooldown_remaining = API_COOLDOWN_UNTIL - time.monotonic()
+    if cooldown_remaining > 0 and not bypass_cooldown:
+        # Jangan menambah beban selama cooldown; pemanggil menerima 429 dan bisa mencoba lagi nanti
+        return {"error_message": f"API sedang membatasi permintaan. Coba lagi dalam {int(cooldown_remaining) + 1} detik."}, 429
+    try:
+        async with CLAIM_SEMAPHORE:
             if method.upper() == 'GET':
                 response_obj = await client.get(url, headers=headers, timeout=timeout)
             elif method.upper() == 'POST':
                 if json_data is not None:
-                    headers_for_json_post = headers.copy()
-                    headers_for_json_post.pop('content-length', None) 
-                    headers_for_json_post.pop('Content-Length', None)
-                    response_obj = await client.post(url, headers=headers_for_json_post, json=json_data, timeout=timeout)
+                    # Pemanggil JSON tidak boleh menyertakan content-length; httpx menghitungnya sendiri
+                    response_obj = await client.post(url, headers=headers, json=json_data, timeout=timeout)
                 elif content_data is not None:
                     response_obj = await client.post(url, headers=headers, content=content_data, timeout=timeout)
                 else:
                     response_obj = await client.post(url, headers=headers, timeout=timeout)
             else:
-                logger.error(f"Metode HTTP tidak didukung: {method}")
+                logger.error("Metode HTTP tidak didukung: %s", method)
                 return None, None
-            response_obj.raise_for_status()
-            if not response_obj.content: 
-                logger.info(f"Menerima respons kosong dari server untuk URL: {url} (Status: {response_obj.status_code})")
-                return {"status": "success", "message": "Respons kosong dari server.", "data_from_api": None}, response_obj.status_code
-            return response_obj.json(), response_obj.status_code
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Error HTTP untuk URL {url}: Status {e.response.status_code} - Respons: {e.response.text[:200]}...")
+        status_code = response_obj.status_code
+        _update_api_cooldown(status_code)
+        # Status non-2xx (mis. 400 TOKEN_CLAIM_TOO_EARLY yang sering terjadi) ditangani langsung tanpa raise/catch
+        if not response_obj.is_success:
+            logger.error("Error HTTP untuk URL %s: Status %s - Respons: %s...", url, status_code, response_obj.text[:200])
             try:
-                error_json = e.response.json()
-                return error_json, e.response.status_code
-            except json.JSONDecodeError:
-                return {"error_message": e.response.text, "status_code_custom": e.response.status_code}, e.response.status_code
-        except httpx.TimeoutException as e:
-            logger.error(f"Request timeout untuk URL {url}: {e}")
-            return {"error_message": "Request ke API timeout."}, None
-        except httpx.RequestError as e: 
-            logger.error(f"Error koneksi untuk URL {url}: {e}")
-            return {"error_message": f"Gagal terhubung ke API: {e}"}, None
-        except json.JSONDecodeError as e:
-            raw_text = response_obj.text[:200] if response_obj and hasattr(response_obj, 'text') else "N/A"
-            status_code = response_obj.status_code if response_obj else None
-            logger.error(f"Gagal decode JSON dari URL {url} (Teks Respons Awal: {raw_text}...): {e}")
-            return {"error_message": "Format respons dari API tidak valid (bukan JSON).", "raw_response": raw_text}, status_code
-
+                return orjson.loads(response_obj.content), status_code
+            except orjson.JSONDecodeError:
+                return {"error_message": response_obj.text, "status_code_custom": status_code}, status_code
+        if not response_obj.content: 
+            logger.debug("Menerima respons kosong dari server untuk URL: %s (Status: %s)", url, status_code)
+            return {"status": "success", "message": EMPTY_RESPONSE_MESSAGE, "data_from_api": None}, status_code
+        return orjson.loads(response_obj.content), status_code
+    except httpx.TimeoutException as e:
+        logger.error("Request timeout untuk URL %s: %s", url, e)
+        return {"error_message": "Request ke API timeout."}, None
+    except httpx.RequestError as e: 
+        logger.error("Error koneksi untuk URL %s: %s", url, e)
+        return {"error_message": f"Gagal terhubung ke API: {e}"}, None
+    except orjson.JSONDecodeError as e:
+        raw_text = response_obj.text[:200] if response_obj and hasattr(response_obj, 'text') else "N/A"
+        status_code = response_obj.status_code if response_obj else None
+        logger.error("Gagal decode JSON dari URL %s (Teks Respons Awal: %s...): %s", url, raw_text, e)
+        return {"error_message": "Format respons dari API tidak valid (bukan JSON).", "raw_response": raw_text}, status_code
+
+@functools.lru_cache(maxsize=4096)
+def _format_wib_ms(timestamp_ms: int | float) -> str:
+    # Hasil hanya bergantung pada timestamp, jadi aman di-cache (lastClaimTime yang sama sering diformat ulang)
+    try:
+        return datetime.fromtimestamp(timestamp_ms / 1000, tz=WIB).strftime(WIB_TIMESTAMP_FORMAT)
+    except Exception as e:
+        logger.warning("Gagal format timestamp %s: %s", timestamp_ms, e)
+        return "Timestamp Tidak Valid"
 def format_timestamp_wib(timestamp_ms: int | float) -> str:
-    # ... (kode sama)
+    # Validasi tipe di luar cache: nilai dari API bisa berupa list/dict yang tidak hashable
     if isinstance(timestamp_ms, (int, float)) and timestamp_ms > 0:
-        try:
-            dt_utc = datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc)
-            dt_wib = dt_utc.astimezone(WIB)
-            return dt_wib.strftime('%Y-%m-%d %H:%M:%S %Z')
-        except Exception as e:
-            logger.warning(f"Gagal format timestamp {timestamp_ms}: {e}")
-            return "Timestamp Tidak Valid"
+        return _format_wib_ms(timestamp_ms)
     return "N/A"
 
-async def get_auth_token(user_id: int) -> str | None: return (await load_user_data(user_id)).get("auth_token")
-async def api_get_user_profile(auth_token: str) -> tuple[dict | None, str]:
-    # ... (kode sama)
-    headers = {**BASE_API_HEADERS, 'authorization': f"Bearer {auth_token}"}
-    data, status = await make_api_request('GET', AUTH_URL, headers)
-    if data and status == 200 and 'data' in data:
-        return data['data'], data.get("message", "Profil berhasil dimuat.")
-    elif data and 'message' in data:
-        return None, f"Gagal: {data['message']} (Status: {status})"
-    elif data and 'error_message' in data:
-        return None, f"Error API: {data['error_message']}"
-    return None, "Gagal memuat profil. Respons tidak diketahui dari server."
-
-async def api_get_token_info(auth_token: str) -> tuple[dict | None, str]:
-    # ... (kode sama)
-    headers = {**BASE_API_HEADERS, 'authorization': f"Bearer {auth_token}"}
-    data, status = await make_api_request('GET', TOKEN_INFO_URL, headers)
-    if data and status == 200 and 'data' in data:
-        return data['data'], data.get("message", "Informasi token berhasil dimuat.")
-    elif data and 'message' in data:
-        return None, f"Gagal: {data['message']} (Status: {status})"
-    elif data and 'error_message' in data:
-        return None, f"Error API: {data['error_message']}"
-    return None, "Gagal memuat informasi token. Respons tidak diketahui dari server."
-
-async def api_check_claimable(auth_token: str) -> tuple[dict | None, str, int | None]:
-    # ... (kode sama)
-    headers = {**BASE_API_HEADERS, 'authorization': f"Bearer {auth_token}"}
-    data_wrapper, status_code_response = await make_api_request('GET', CHECK_CLAIMABLE_URL, headers)
-    message_to_return = "Gagal memeriksa status klaim. Respons tidak diketahui dari server."
-    actual_data_payload = None
-    if data_wrapper: 
-        if status_code_response == 200 and 'data' in data_wrapper:
-            actual_data_payload = data_wrapper['data']
-            message_to_return = data_wrapper.get('message', "Status klaim berhasil diperiksa.")
-        elif 'message' in data_wrapper:
-            message_to_return = f"Gagal: {data_wrapper['message']} (Status: {status_code_response})"
-        elif 'error_message' in data_wrapper:
-            message_to_return = f"Error API: {data_wrapper['error_message']}"
-    return actual_data_payload, message_to_return, status_code_response
-
-async def api_claim_airdrop(auth_token: str) -> tuple[dict | None, str, int | None]:
-    # ... (kode sama)
-    headers = {**BASE_API_HEADERS, 'authorization': f"Bearer {auth_token}", 'content-length': '0'}
-    response_data_dict, status_code_response = await make_api_request('POST', CLAIM_AIRDROP_URL, headers, content_data="", timeout=20)
-    message_to_return = "Gagal melakukan klaim. Respons tidak diketahui dari server."
-    actual_api_payload = response_data_dict 
-    if response_data_dict:
-        if status_code_response == 200 and 'data' in response_data_dict and isinstance(response_data_dict.get('data'), bool): 
-            message_to_return = response_data_dict.get('message', 'Proses klaim selesai.')
-        elif status_code_response == 400 and response_data_dict.get('message') == "TOKEN_CLAIM_TOO_EARLY":
-            message_to_return = "Gagal Klaim: Waktu klaim token terlalu dini."
-        elif 'message' in response_data_dict: 
-            message_to_return = f"Gagal Klaim: {response_data_dict['message']} (Status: {status_code_response})"
-        elif 'error_message' in response_data_dict: 
-            message_to_return = f"Error API Internal: {response_data_dict['error_message']}"
-        elif status_code_response == 200 and response_data_dict.get('message') == "Respons kosong dari server.":
-             if response_data_dict.get('data_from_api') is None and 'data' not in response_data_dict: 
-                 message_to_return = "Proses klaim selesai dengan respons kosong dari server. Silakan periksa status token Anda." 
-    return actual_api_payload, message_to_return, status_code_response
+@functools.lru_cache(maxsize=1024)
+def get_auth_headers(auth_token: str) -> dict:
+    # Dibangun sekali per token; token baru dari /settoken otomatis menjadi entri cache baru. Jangan diubah oleh pemanggil.
+    return {**BASE_API_HEADERS, 'authorization': f"Bearer {auth_token}"}
+@functools.lru_cache(maxsize=1024)
+def get_claim_headers(auth_token: str) -> dict:
+    # Varian untuk POST claim-airdrop yang body-nya kosong
+    return {**get_auth_headers(auth_token), 'content-length': '0'}
+def _decode_token_exp(token: str) -> int | None:
+    # Hanya membaca klaim 'exp' dari payload JWT (tanpa verifikasi tanda tangan); token non-JWT dianggap tanpa kedaluwarsa
+    try:
+        payload = orjson.loads(base64.urlsafe_b64decode(token.split('.')[1] + '=='))
+        exp = payload.get('exp') if isinstance(payload, dict) else None
+        # bool adalah subclass int (True akan terbaca sebagai exp=1); inf/nan dan angka raksasa juga ditolak
+        if isinstance(exp, bool) or not isinstance(exp, (int, float)) or not math.isfinite(exp):
+            return None
+        return int(exp)
+    except (IndexError, ValueError, OverflowError):
+        return None
+async def resolve_auth_token(user_id: int) -> tuple[str | None, str | None]:
+    # (token, None) bila token bisa dipakai; (None, teks untuk pengguna) bila belum diatur atau sudah kedaluwarsa
+    user_data = await load_user_data(user_id)
+    auth_token = user_data.get("auth_token")
+    if not auth_token:
+        return None, NO_TOKEN_TEXT
+    exp = user_data.get("auth_token_exp")
+    # Token yang (hampir) kedaluwarsa tidak dipakai agar tidak ada request yang pasti ditolak 401
+    if exp is not None and time.time() > exp - TOKEN_EXPIRY_MARGIN:
+        return None, TOKEN_EXPIRED_TEXT
+    return auth_token, None
+async def get_auth_token(user_id: int) -> str | None: return (await resolve_auth_token(user_id))[0]
+def _extract_payload(data: dict | None, status: int | None, ok_msg: str, unknown_msg: str, fail_label: str = "Gagal", error_label: str = "Error API", known_errors: dict[tuple[int, str], str] | None = None, empty_msg: str | None = None, success_check=None) -> tuple[dict | None, str]:
+    # Pola respons bersama: {'data': ...} saat sukses, 'message'/'error_message' saat gagal.
+    # success_check(data) mengganti syarat sukses default ('data' ada), known_errors memetakan (status, 'message') ke teks khusus,
+    # empty_msg dipakai untuk respons 2xx tanpa body
+    if data:
+        if status == 200 and (success_check(data) if success_check else 'data' in data):
+            return data.get('data'), data.get("message", ok_msg)
+        if empty_msg and data.get('message') == EMPTY_RESPONSE_MESSAGE and 'data_from_api' in data:
+            return None, empty_msg
+        if 'message' in data:
+            if known_errors and isinstance(data['message'], str) and (status, data['message']) in known_errors:
+                return None, known_errors[(status, data['message'])]
+            return None, f"{fail_label}: {data['message']} (Status: {status})"
+        if 'error_message' in data:
+            return None, f"{error_label}: {data['error_message']}"
+    return None, unknown_msg
+
+# interactive=True untuk panggilan dari perintah pengguna: tidak ditahan cooldown 429 yang ditujukan untuk loop latar belakang
+async def api_get_user_profile(auth_token: str, interactive: bool = False) -> tuple[dict | None, str]:
+    data, status = await make_api_request('GET', AUTH_URL, get_auth_headers(auth_token), bypass_cooldown=interactive)
+    return _extract_payload(data, status, "Profil berhasil dimuat.", "Gagal memuat profil. Respons tidak diketahui dari server.")
+
+async def api_get_token_info(auth_token: str, interactive: bool = False) -> tuple[dict | None, str]:
+    data, status = await make_api_request('GET', TOKEN_INFO_URL, get_auth_headers(auth_token), bypass_cooldown=interactive)
+    return _extract_payload(data, status, "Informasi token berhasil dimuat.", "Gagal memuat informasi token. Respons tidak diketahui dari server.")
+
+async def api_check_claimable(auth_token: str, interactive: bool = False) -> tuple[dict | None, str, int | None]:
+    data, status = await make_api_request('GET', CHECK_CLAIMABLE_URL, get_auth_headers(auth_token), bypass_cooldown=interactive)
+    payload, message = _extract_payload(data, status, "Status klaim berhasil diperiksa.", "Gagal memeriksa status klaim. Respons tidak diketahui dari server.")
+    return payload, message, status
+
+async def api_claim_airdrop(auth_token: str, interactive: bool = False) -> tuple[dict | None, str, int | None]:
+    # Pemanggil memakai seluruh body respons (bukan hanya 'data'), jadi hanya pesannya yang diambil dari _extract_payload
+    data, status = await make_api_request('POST', CLAIM_AIRDROP_URL, get_claim_headers(auth_token), content_data="", timeout=20, bypass_cooldown=interactive)
+    _, message = _extract_payload(
+        data, status, "Proses klaim selesai.", "Gagal melakukan klaim. Respons tidak diketahui dari server.",
+        fail_label="Gagal Klaim", error_label="Error API Internal", known_errors=CLAIM_ERROR_MESSAGES,
+        empty_msg="Proses klaim selesai dengan respons kosong dari server. Silakan periksa status token Anda.",
+        # Klaim hanya dianggap berhasil bila server mengembalikan 'data' boolean
+        success_check=lambda body: isinstance(body.get('data'), bool),
+    )
+    return data, message, status
 
 # --- Inline Keyboard Markups (Sama seperti sebelumnya) ---
 def main_menu_keyboard(): # ... (kode sama)
@@ -254,45 +478,100 @@ def autoclaim_menu_keyboard(): # ... (kode sama)
 def back_to_main_menu_button(): # ... (kode sama)
      return InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Kembali ke Menu Utama", callback_data='main_menu')]])
 
+# Markup tidak pernah berubah selama bot berjalan, jadi cukup dibangun sekali saat import
+MAIN_MENU_MARKUP = main_menu_keyboard()
+AUTOCLAIM_MENU_MARKUP = autoclaim_menu_keyboard()
+BACK_TO_MAIN_MARKUP = back_to_main_menu_button()
+
+# --- Teks Pesan Statis ---
+# Semua template memakai ParseMode.HTML; nilai dari server wajib melewati _esc() sebelum disisipkan
+MENU_TEXT = (
+    "👋 <b>Selamat Datang di Asisten Bot Interlink Anda!</b>\n\n"
+    "Bot ini dirancang untuk membantu Anda mengelola akun Interlink dengan lebih efisien.\n"
+    "Silakan pilih salah satu opsi di bawah ini untuk memulai.\n\n"
+    "Pastikan token autentikasi Anda telah diatur dengan benar untuk fungsionalitas penuh."
+)
+SETTOKEN_HELP_TEXT = (
+    "ℹ️ <b>Informasi Pengaturan Token Autentikasi</b>\n\n"
+    "Untuk mengatur atau memperbarui token Anda, gunakan format perintah:\n"
+    "<code>/settoken TOKEN_ANDA_DISINI</code>\n\n"
+    "<b>Contoh Penggunaan:</b>\n"
+    "<code>/settoken eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJsb2dp...</code>\n\n"
+    "Token ini biasanya dapat ditemukan menggunakan Developer Tools pada browser Anda (umumnya pada tab 'Network' atau 'Jaringan') saat Anda masuk ke layanan Interlink."
+)
+INVALID_TOKEN_FORMAT_TEXT = "⚠️ Format token yang Anda masukkan tampak tidak valid. Token Bearer umumnya diawali dengan 'ey'. Mohon periksa kembali."
+TOKEN_SAVED_TEXT = "✅ Token autentikasi Anda telah berhasil disimpan."
+TOKEN_VERIFYING_TEXT = "Sedang melakukan verifikasi token dengan mengambil data profil Anda..."
+NO_TOKEN_TEXT = "Token autentikasi belum diatur. Silakan atur token Anda melalui opsi 'Atur Token Autentikasi' pada menu utama, atau ketik perintah <code>/settoken &lt;TOKEN_ANDA&gt;</code>."
+TOKEN_EXPIRED_TEXT = "⌛ Token autentikasi Anda sudah kedaluwarsa. Silakan ambil token baru lalu atur ulang melalui opsi 'Atur Token Autentikasi' pada menu utama, atau ketik perintah <code>/settoken &lt;TOKEN_ANDA&gt;</code>."
+TOKEN_VERIFIED_TEMPLATE = (
+    "✅ Token berhasil diverifikasi!\n\n"
+    "👤 <b>Nama Pengguna:</b> <code>{username}</code>\n"
+    "📧 <b>Alamat Email:</b> <code>{email}</code>"
+)
+TOKEN_VERIFY_FAILED_TEMPLATE = "⚠️ Verifikasi token gagal.\n<b>Pesan dari Server:</b> <code>{message}</code>\n\nPastikan token yang Anda masukkan sudah benar dan masih berlaku."
+PROFILE_TEMPLATE = (
+    "👤 <b>Profil Pengguna Akun Interlink Anda</b>\n\n"
+    "▫️ <b>Nama Pengguna:</b> <code>{username}</code>\n"
+    "▫️ <b>Alamat Email:</b> <code>{email}</code>\n"
+    "▫️ <b>Peran Akun:</b> <code>{role}</code>\n"
+    "▫️ <b>ID Login:</b> <code>{loginId}</code>\n"
+    "▫️ <b>Tanggal Dibuat:</b> <code>{createdAt}</code>"
+)
+PROFILE_FAILED_TEMPLATE = " Gagal memuat profil.\n<b>Pesan dari Server:</b> <code>{message}</code>"
+
+def _esc(value) -> str: return html.escape(str(value))
+
 # --- Fungsi Utilitas Pesan (Sama seperti sebelumnya) ---
-async def edit_or_send_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup = None, parse_mode: str = ParseMode.MARKDOWN, message_id: int | None = None):
-    # ... (kode sama)
+def _remember_render(chat_id: int, message_id: int, render_hash: int):
+    key = (chat_id, message_id)
+    LAST_RENDER[key] = render_hash
+    LAST_RENDER.move_to_end(key)
+    if len(LAST_RENDER) > LAST_RENDER_MAXSIZE:
+        LAST_RENDER.popitem(last=False)
+
+async def edit_or_send_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup = None, parse_mode: str = ParseMode.HTML, message_id: int | None = None):
+    # Hash markup PTB dihitung dari isi tombolnya (tanpa serialisasi JSON); None juga bisa di-hash
+    render_hash = hash((text, parse_mode, reply_markup))
     if message_id:
+        if LAST_RENDER.get((chat_id, message_id)) == render_hash:
+            logger.debug("Konten sama dengan render terakhir, edit dilewati untuk chat %s, message %s.", chat_id, message_id)
+            return message_id
         try:
             await context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+            _remember_render(chat_id, message_id, render_hash)
             return message_id
         except BadRequest as e:
             if "message is not modified" in str(e).lower():
-                logger.info(f"Pesan tidak diubah untuk chat {chat_id}, message {message_id}.")
+                logger.debug("Pesan tidak diubah untuk chat %s, message %s.", chat_id, message_id)
+                _remember_render(chat_id, message_id, render_hash)
                 return message_id 
-            logger.warning(f"Gagal mengedit pesan (ID: {message_id}) di chat {chat_id}, mengirim pesan baru: {e}")
+            # Pesan terhapus atau diubah di luar bot ("message to edit not found" dll.): hash lamanya tidak lagi berlaku
+            LAST_RENDER.pop((chat_id, message_id), None)
+            logger.warning("Gagal mengedit pesan (ID: %s) di chat %s, mengirim pesan baru: %s", message_id, chat_id, e)
         except Exception as e:
-            logger.error(f"Error tak terduga saat mengedit pesan (ID: {message_id}) di chat {chat_id}: {e}", exc_info=True)
+            LAST_RENDER.pop((chat_id, message_id), None)
+            logger.error("Error tak terduga saat mengedit pesan (ID: %s) di chat %s: %s", message_id, chat_id, e, exc_info=True)
     new_message = await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+    _remember_render(chat_id, new_message.message_id, render_hash)
     return new_message.message_id
 
 # --- Command Handlers and Action Functions ---
 async def send_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int | None = None):
     # ... (kode sama)
-    menu_text = (
-        "👋 *Selamat Datang di Asisten Bot Interlink Anda!*\n\n"
-        "Bot ini dirancang untuk membantu Anda mengelola akun Interlink dengan lebih efisien.\n"
-        "Silakan pilih salah satu opsi di bawah ini untuk memulai.\n\n"
-        "Pastikan token autentikasi Anda telah diatur dengan benar untuk fungsionalitas penuh."
-    )
-    await edit_or_send_message(context, chat_id, menu_text, main_menu_keyboard(), message_id=message_id)
+    await edit_or_send_message(context, chat_id, MENU_TEXT, MAIN_MENU_MARKUP, message_id=message_id)
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE): # ... (kode sama)
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    logger.info(f"Perintah /start diterima dari pengguna {user_id} di chat {chat_id}.")
+    logger.info("Perintah /start diterima dari pengguna %s di chat %s.", user_id, chat_id)
     await context.bot.send_chat_action(chat_id=user_id, action=ChatAction.TYPING)
     await send_main_menu(update, context, chat_id)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE): # ... (kode sama)
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    logger.info(f"Perintah /help diterima dari pengguna {user_id} di chat {chat_id}.")
+    logger.info("Perintah /help diterima dari pengguna %s di chat %s.", user_id, chat_id)
     await context.bot.send_chat_action(chat_id=user_id, action=ChatAction.TYPING)
     await send_main_menu(update, context, chat_id)
 
@@ -306,86 +585,93 @@ def get_ids_from_update(update: Update) -> tuple[int | None, int | None]: # ...
         chat_id = update.message.chat_id
     return user_id, chat_id
 
+def serialize_per_user(handler):
+    # Handler didaftarkan dengan block=False; update dari pengguna yang sama tetap diproses berurutan
+    # (mis. /settoken tidak berpacu dengan /profile), sedangkan pengguna berbeda berjalan bersamaan
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id, _ = get_ids_from_update(update)
+        if user_id is None:
+            return await handler(update, context)
+        async with get_user_update_lock(user_id):
+            return await handler(update, context)
+    return wrapper
+
 async def set_token_command(update: Update, context: ContextTypes.DEFAULT_TYPE): # ... (kode sama)
     user_id, chat_id = get_ids_from_update(update)
     if not chat_id or not user_id : return 
-    logger.info(f"Perintah /settoken diterima dari pengguna {user_id}.")
+    logger.info("Perintah /settoken diterima dari pengguna %s.", user_id)
     await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
     if not context.args:
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=(
-                "ℹ️ *Informasi Pengaturan Token Autentikasi*\n\n"
-                "Untuk mengatur atau memperbarui token Anda, gunakan format perintah:\n"
-                "`/settoken TOKEN_ANDA_DISINI`\n\n"
-                "*Contoh Penggunaan:*\n"
-                "`/settoken eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJsb2dp...`\n\n"
-                "Token ini biasanya dapat ditemukan menggunakan Developer Tools pada browser Anda (umumnya pada tab 'Network' atau 'Jaringan') saat Anda masuk ke layanan Interlink."
-            ), parse_mode=ParseMode.MARKDOWN
-        )
+        await context.bot.send_message(chat_id=chat_id, text=SETTOKEN_HELP_TEXT, parse_mode=ParseMode.HTML)
         return
     token = context.args[0]
     if not token.startswith("ey"): 
-        await context.bot.send_message(chat_id=chat_id, text="⚠️ Format token yang Anda masukkan tampak tidak valid. Token Bearer umumnya diawali dengan 'ey'. Mohon periksa kembali.")
+        await context.bot.send_message(chat_id=chat_id, text=INVALID_TOKEN_FORMAT_TEXT)
         return
-    user_data = await load_user_data(user_id)
-    user_data["auth_token"] = token
-    await save_user_data(user_id, user_data)
-    await context.bot.send_message(chat_id=chat_id, text="✅ Token autentikasi Anda telah berhasil disimpan.")
-    logger.info(f"Token autentikasi berhasil disimpan untuk pengguna {user_id}.")
-    await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-    verif_message = await context.bot.send_message(chat_id=chat_id, text="Sedang melakukan verifikasi token dengan mengambil data profil Anda...")
-    profile_data, message = await api_get_user_profile(token) 
+    # Verifikasi ke API dimulai sekarang agar berjalan bersamaan dengan penyimpanan dan pesan Telegram di bawah
+    profile_task = asyncio.create_task(api_get_user_profile(token, interactive=True))
+    try:
+        user_data = await load_user_data(user_id)
+        user_data["auth_token"] = token
+        user_data["auth_token_exp"] = _decode_token_exp(token)
+        await save_user_data(user_id, user_data)
+        await context.bot.send_message(chat_id=chat_id, text=TOKEN_SAVED_TEXT)
+        logger.info("Token autentikasi berhasil disimpan untuk pengguna %s.", user_id)
+        await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+        verif_message = await context.bot.send_message(chat_id=chat_id, text=TOKEN_VERIFYING_TEXT)
+        profile_data, message = await profile_task
+    finally:
+        # Jika panggilan Telegram di atas gagal, request profil dibatalkan agar tidak menjadi tugas yatim
+        if not profile_task.done():
+            profile_task.cancel()
     reply_text = ""
     if profile_data:
         username = profile_data.get('username', 'N/A')
         email = profile_data.get('email', 'N/A')
-        reply_text = (f"✅ Token berhasil diverifikasi!\n\n"
-                      f"👤 *Nama Pengguna:* `{username}`\n"
-                      f"📧 *Alamat Email:* `{email}`")
-        logger.info(f"Token untuk pengguna {user_id} berhasil diverifikasi. Username: {username}")
+        reply_text = TOKEN_VERIFIED_TEMPLATE.format(username=_esc(username), email=_esc(email))
+        logger.info("Token untuk pengguna %s berhasil diverifikasi. Username: %s", user_id, username)
     else:
-        reply_text = f"⚠️ Verifikasi token gagal.\n*Pesan dari Server:* `{message}`\n\nPastikan token yang Anda masukkan sudah benar dan masih berlaku."
-        logger.warning(f"Gagal verifikasi token untuk pengguna {user_id}. Pesan: {message}")
-    await edit_or_send_message(context, chat_id, reply_text, back_to_main_menu_button(), message_id=verif_message.message_id)
+        reply_text = TOKEN_VERIFY_FAILED_TEMPLATE.format(message=_esc(message))
+        logger.warning("Gagal verifikasi token untuk pengguna %s. Pesan: %s", user_id, message)
+    await edit_or_send_message(context, chat_id, reply_text, BACK_TO_MAIN_MARKUP, message_id=verif_message.message_id)
 
 async def core_profile_action(user_id: int, chat_id: int, context: ContextTypes.DEFAULT_TYPE, message_id: int | None = None):
     # ... (kode sama)
-    logger.info(f"Memuat profil untuk pengguna {user_id}.")
+    logger.debug("Memuat profil untuk pengguna %s.", user_id)
     await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-    auth_token = await get_auth_token(user_id)
+    auth_token, no_token_text = await resolve_auth_token(user_id)
     if not auth_token:
-        error_text = "Token autentikasi belum diatur. Silakan atur token Anda melalui opsi 'Atur Token Autentikasi' pada menu utama, atau ketik perintah `/settoken <TOKEN_ANDA>`."
-        await edit_or_send_message(context, chat_id, error_text, back_to_main_menu_button(), message_id=message_id)
+        await edit_or_send_message(context, chat_id, no_token_text, BACK_TO_MAIN_MARKUP, message_id=message_id)
         return
-    if message_id: 
-        await edit_or_send_message(context, chat_id, "⏳ Memuat informasi profil Anda...", message_id=message_id, reply_markup=None)
-    else: 
-        temp_msg = await context.bot.send_message(chat_id=chat_id, text="⏳ Memuat informasi profil Anda...")
-        message_id = temp_msg.message_id
-    profile_data, message = await api_get_user_profile(auth_token)
+    # Request profil berjalan bersamaan dengan pesan "memuat" ke Telegram
+    profile_task = asyncio.create_task(api_get_user_profile(auth_token, interactive=True))
+    try:
+        if message_id: 
+            await edit_or_send_message(context, chat_id, "⏳ Memuat informasi profil Anda...", message_id=message_id, reply_markup=None)
+        else: 
+            temp_msg = await context.bot.send_message(chat_id=chat_id, text="⏳ Memuat informasi profil Anda...")
+            message_id = temp_msg.message_id
+        profile_data, message = await profile_task
+    finally:
+        if not profile_task.done():
+            profile_task.cancel()
     reply_text = ""
     if profile_data:
-        reply_text = (f"👤 *Profil Pengguna Akun Interlink Anda*\n\n"
-                      f"▫️ *Nama Pengguna:* `{profile_data.get('username', 'N/A')}`\n"
-                      f"▫️ *Alamat Email:* `{profile_data.get('email', 'N/A')}`\n"
-                      f"▫️ *Peran Akun:* `{profile_data.get('role', 'N/A')}`\n"
-                      f"▫️ *ID Login:* `{profile_data.get('loginId', 'N/A')}`\n"
-                      f"▫️ *Tanggal Dibuat:* `{profile_data.get('createdAt', 'N/A')}`")
-        logger.info(f"Profil berhasil dimuat untuk pengguna {user_id}. Username: {profile_data.get('username', 'N/A')}")
+        reply_text = PROFILE_TEMPLATE.format(**{field: _esc(profile_data.get(field, 'N/A')) for field in ('username', 'email', 'role', 'loginId', 'createdAt')})
+        logger.debug("Profil berhasil dimuat untuk pengguna %s. Username: %s", user_id, profile_data.get('username', 'N/A'))
     else:
-        reply_text = f" Gagal memuat profil.\n*Pesan dari Server:* `{message}`"
-        logger.warning(f"Gagal memuat profil untuk pengguna {user_id}. Pesan: {message}")
-    await edit_or_send_message(context, chat_id, reply_text, back_to_main_menu_button(), message_id=message_id)
+        reply_text = PROFILE_FAILED_TEMPLATE.format(message=_esc(message))
+        logger.warning("Gagal memuat profil untuk pengguna %s. Pesan: %s", user_id, message)
+    await edit_or_send_message(context, chat_id, reply_text, BACK_TO_MAIN_MARKUP, message_id=message_id)
 
 async def core_tokens_action(user_id: int, chat_id: int, context: ContextTypes.DEFAULT_TYPE, message_id: int | None = None):
     # ... (kode sama)
-    logger.info(f"Memuat informasi token untuk pengguna {user_id}.")
+    logger.debug("Memuat informasi token untuk pengguna %s.", user_id)
     await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-    auth_token = await get_auth_token(user_id)
+    auth_token, no_token_text = await resolve_auth_token(user_id)
     if not auth_token:
-        error_text = "Token autentikasi belum diatur. Silakan atur token Anda melalui opsi 'Atur Token Autentikasi' pada menu utama, atau ketik perintah `/settoken <TOKEN_ANDA>`."
-        await edit_or_send_message(context, chat_id, error_text, back_to_main_menu_button(), message_id=message_id)
+        await edit_or_send_message(context, chat_id, no_token_text, BACK_TO_MAIN_MARKUP, message_id=message_id)
         return
     if message_id:
         await edit_or_send_message(context, chat_id, "⏳ Memuat informasi token Anda...", message_id=message_id, reply_markup=None)
@@ -394,33 +680,119 @@ async def core_tokens_action(user_id: int, chat_id: int, context: ContextTypes.D
         message_id = temp_msg.message_id
     token_info_payload, message = await api_get_token_info
 
+# --- Siklus Hidup Aplikasi ---
+async def post_init(application: Application) -> None:
+    global HTTP_CLIENT
+    # Satu client bersama agar koneksi TCP+TLS ke API Interlink dipakai ulang (keep-alive + HTTP/2)
+    HTTP_CLIENT = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=100, max_connections=200, keepalive_expiry=30),
+        timeout=20,
+    )
+    logger.info("HTTP client bersama untuk API Interlink telah dibuat.")
+
+    # Daftar perintah hanya dikirim ke Telegram bila berubah sejak registrasi terakhir untuk bot yang sama;
+    # id bot ikut di-hash agar pergantian TELEGRAM_BOT_TOKEN pada disk yang sama tetap mendaftarkan perintah
+    commands_hash = hashlib.blake2b(repr((application.bot.id, [(c.command, c.description) for c in BOT_COMMANDS])).encode(), digest_size=8).hexdigest()
+    previous_hash = None
+    try:
+        previous_hash = (await asyncio.to_thread(_read_json_file, BOT_COMMANDS_HASH_FILE)).get("hash")
+    except FileNotFoundError:
+        pass
+    except (OSError, orjson.JSONDecodeError, AttributeError) as e:
+        logger.warning("Gagal membaca hash perintah bot, perintah akan didaftarkan ulang: %s", e)
+    if previous_hash != commands_hash:
+        try:
+            await application.bot.set_my_commands(BOT_COMMANDS)
+            await asyncio.to_thread(_write_file_atomic, BOT_COMMANDS_HASH_FILE, orjson.dumps({"bot_id": application.bot.id, "hash": commands_hash}))
+            logger.info("Daftar perintah bot telah diperbarui.")
+        except TelegramError as e:
+            logger.warning("Gagal mendaftarkan perintah bot: %s", e)
+        except OSError as e:
+            logger.warning("Perintah bot terdaftar, tetapi hash gagal disimpan: %s", e)
+
+async def cleanup_after_shutdown(application: Application) -> None:
+    global HTTP_CLIENT
+    if AUTO_CLAIM_TASKS:
+        logger.info("Menghentikan %d tugas auto-claim yang masih berjalan...", len(AUTO_CLAIM_TASKS))
+        for task in AUTO_CLAIM_TASKS.values():
+            task.cancel()
+        try:
+            # Dibatasi waktu agar shutdown tidak menggantung melewati jendela SIGKILL Render
+            await asyncio.wait_for(asyncio.gather(*AUTO_CLAIM_TASKS.values(), return_exceptions=True), timeout=5.0)
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown dipaksakan: %d tugas auto-claim tidak berhenti dalam 5 detik.", sum(1 for t in AUTO_CLAIM_TASKS.values() if not t.done()))
+        finally:
+            AUTO_CLAIM_TASKS.clear()
+    if HTTP_CLIENT is not None:
+        await HTTP_CLIENT.aclose()
+        HTTP_CLIENT = None
+        logger.info("HTTP client bersama telah ditutup.")
+
 # Modifikasi fungsi main untuk mendukung webhook jika diperlukan
 def main() -> None:
-    if not TELEGRAM_BOT_TOKEN:
-        logger.critical("TELEGRAM_BOT_TOKEN environment variable belum diatur! Bot tidak dapat dijalankan.")
-        return
+    # Satu event loop eksplisit untuk seluruh umur proses; run_polling/run_webhook memakai loop ini.
+    # uvloop menggantikan selector loop bawaan asyncio; opsional agar tetap jalan di Windows
+    try:
+        import uvloop
+        loop = uvloop.new_event_loop()
+        logger.info("uvloop aktif sebagai event loop.")
+    except ImportError:
+        loop = asyncio.new_event_loop()
+        logger.info("uvloop tidak tersedia, menggunakan event loop bawaan asyncio.")
+    asyncio.set_event_loop(loop)
         
     logger.info("Memulai konfigurasi aplikasi bot...")
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
-    
-    # Handler setup
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("settoken", set_token_command))
-    application.add_handler(CallbackQueryHandler(button_tap_handler))
-    application.add_handler(CommandHandler("profile", profile_command_typed))
-    application.add_handler(CommandHandler("tokens", tokens_command_typed))
-    application.add_handler(CommandHandler("claimstatus", claim_status_command_typed))
-    application.add_handler(CommandHandler("claim", claim_command_typed))
-    application.add_handler(CommandHandler("history", history_command_typed))
-    application.add_handler(CommandHandler("autoclaim_start", autoclaim_start_command_typed))
-    application.add_handler(CommandHandler("autoclaim_stop", autoclaim_stop_command_typed))
-    application.add_handler(CommandHandler("autoclaim_status", autoclaim_status_command_typed))
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .request(OrjsonHTTPXRequest(connection_pool_size=256))
+        .get_updates_request(OrjsonHTTPXRequest())
+        # Menahan panggilan Bot API di bawah batas Telegram dan mengulang otomatis bila tetap terkena 429
+        .rate_limiter(AIORateLimiter(max_retries=3))
+        .post_init(post_init)
+        .post_shutdown(cleanup_after_shutdown)
+        .build()
+    )
     
-    logger.info("Aplikasi bot berhasil dikonfigurasi. Memulai polling...")
+    # Handler setup: daftar perintah diambil dari BOT_COMMANDS agar yang terdaftar selalu sama dengan yang diiklankan
+    command_handlers = {
+        "start": start_command,
+        "help": help_command,
+        "settoken": set_token_command,
+        "profile": profile_command_typed,
+        "tokens": tokens_command_typed,
+        "claimstatus": claim_status_command_typed,
+        "claim": claim_command_typed,
+        "history": history_command_typed,
+        "autoclaim_start": autoclaim_start_command_typed,
+        "autoclaim_stop": autoclaim_stop_command_typed,
+        "autoclaim_status": autoclaim_status_command_typed,
+    }
+    advertised = {bot_command.command for bot_command in BOT_COMMANDS}
+    if advertised != command_handlers.keys():
+        raise RuntimeError(f"BOT_COMMANDS dan handler tidak sinkron: {sorted(advertised ^ command_handlers.keys())}")
+    # block=False: update dari pengguna lain tidak menunggu handler yang sedang menunggu API Interlink;
+    # serialize_per_user menjaga urutan update milik pengguna yang sama
+    for bot_command in BOT_COMMANDS:
+        application.add_handler(CommandHandler(bot_command.command, serialize_per_user(command_handlers[bot_command.command]), block=False))
+    application.add_handler(CallbackQueryHandler(serialize_per_user(button_tap_handler), block=False))
     
-    # Gunakan polling untuk Render (lebih mudah daripada webhook)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        # Di Render gunakan webhook: update didorong oleh Telegram dan port web service langsung terikat
+        logger.info("Aplikasi bot berhasil dikonfigurasi. Memulai webhook di port %s...", PORT)
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        # Polling hanya untuk pengembangan lokal
+        logger.info("Aplikasi bot berhasil dikonfigurasi. Memulai polling...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()